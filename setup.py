@@ -5,46 +5,123 @@ This script will check dependencies, setup directories, and prepare the environm
 """
 
 import os
+import re
+import shutil
+import argparse
+import hashlib
+import itertools
 import sys
-import subprocess
 import logging
 
-# Configure logging
-logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
+# Kaggle credential locations
+_KAGGLE_DIR = os.path.expanduser("~/.kaggle")
+_KAGGLE_JSON = os.path.join(_KAGGLE_DIR, "kaggle.json")
+
+# Trained model and the fingerprint of the data it was trained on
+# (retrain_model.py only reads the test sample directories)
+_MODEL_PATH = 'model/leprosy_classifier.pkl'
+_FINGERPRINT_PATH = 'model/leprosy_classifier.fp'
+_FINGERPRINT_DIRS = (
+    'test_samples/positive',
+    'test_samples/negative',
+)
+
+# Distributions required by the application, in reporting order
+_REQUIRED_PACKAGES = (
+    'flask', 'flask-login', 'flask-sqlalchemy', 'flask-wtf',
+    'matplotlib', 'numpy', 'opencv-python', 'pandas', 'scikit-learn',
+    'pillow', 'werkzeug', 'gunicorn'
+)
+
+_NAME_SEPARATORS = re.compile(r"[-_.]+")
+
+# Other distributions that provide the same import as a required package
+_ALTERNATIVE_DISTRIBUTIONS = {
+    'opencv-python': ('opencv-python-headless', 'opencv-contrib-python',
+                      'opencv-contrib-python-headless'),
+    'pillow': ('pillow-simd',),
+}
+
+def canonicalize_name(name):
+    """Normalize a distribution name as described in PEP 503"""
+    return _NAME_SEPARATORS.sub("-", name).lower()
+
+def parse_args(argv=None):
+    """Parse command line options for non-interactive setup"""
+    parser = argparse.ArgumentParser(description="Set up the Leprosy Detection AI Application.")
+    parser.add_argument('--yes', action='store_true',
+                        help="install missing packages and persist entered credentials without asking")
+    parser.add_argument('--no-install', action='store_true',
+                        help="never install missing packages")
+    parser.add_argument('--kaggle-user', help="Kaggle username")
+    parser.add_argument('--kaggle-key', help="Kaggle API key")
+    parser.add_argument('--skip-data', action='store_true',
+                        help="skip dataset preparation and model training")
+    parser.add_argument('--retrain', action='store_true',
+                        help="retrain the model even if it is up to date or was not produced by setup")
+    args = parser.parse_args(argv)
+    if bool(args.kaggle_user) != bool(args.kaggle_key):
+        parser.error("--kaggle-user and --kaggle-key must be given together")
+    return args
+
+def _confirm(prompt, assume_yes=False):
+    """Ask a yes/no question, answering no when stdin is not a terminal"""
+    if assume_yes:
+        return True
+    if not sys.stdin.isatty():
+        return False
+    return input(prompt).lower() == 'y'
+
 def check_python_version():
     """Check if Python version is compatible"""
     python_version = sys.version_info
     if python_version.major < 3 or (python_version.major == 3 and python_version.minor < 8):
         logger.error("Python 3.8 or higher is required.")
         return False
-    logger.info(f"Python version {python_version.major}.{python_version.minor} detected.")
+    logger.info("Python version %d.%d detected.", python_version.major, python_version.minor)
     return True
 
-def check_dependencies():
+def check_dependencies(args):
     """Check if required Python packages are installed"""
-    required_packages = [
-        'flask', 'flask-login', 'flask-sqlalchemy', 'flask-wtf',
-        'matplotlib', 'numpy', 'opencv-python', 'pandas', 'scikit-learn',
-        'pillow', 'werkzeug', 'gunicorn'
-    ]
+    # Skip the scan if this package set was already verified for this interpreter
+    key = hashlib.sha256(
+        repr((sorted(_REQUIRED_PACKAGES), sys.version, sys.prefix)).encode()
+    ).hexdigest()[:16]
+    marker = os.path.join('instance', f".deps_ok_{key}")
+    if os.access(marker, os.F_OK):
+        logger.info("Dependencies previously verified. Skipping package check.")
+        return True
+    
+    # Imported here so Python < 3.8 reaches check_python_version instead of failing
+    # at import, and so a marker hit above never pays for loading it
+    from importlib.metadata import distributions
+    
+    # Scan installed distribution metadata once instead of importing each package
+    installed = {canonicalize_name(dist.metadata["Name"]) for dist in distributions()
+                 if dist.metadata["Name"]}
     
     missing_packages = []
-    for package in required_packages:
-        try:
-            __import__(package.replace('-', '_'))
-            logger.info(f"Package {package} found.")
-        except ImportError:
+    for package in _REQUIRED_PACKAGES:
+        candidates = (package,) + _ALTERNATIVE_DISTRIBUTIONS.get(package, ())
+        if any(canonicalize_name(name) in installed for name in candidates):
+            logger.info("Package %s found.", package)
+        else:
             missing_packages.append(package)
-            logger.warning(f"Package {package} not found.")
+            logger.warning("Package %s not found.", package)
     
     if missing_packages:
-        logger.error(f"Missing packages: {', '.join(missing_packages)}")
-        install = input("Do you want to install missing packages? (y/n): ")
-        if install.lower() == 'y':
+        logger.error("Missing packages: %s", ', '.join(missing_packages))
+        if not args.no_install and _confirm("Do you want to install missing packages? (y/n): ", args.yes):
+            import subprocess
             try:
-                subprocess.check_call([sys.executable, "-m", "pip", "install"] + missing_packages)
+                # Prefer uv (used for this project's lockfile) over spawning pip
+                if shutil.which("uv"):
+                    pip_cmd = ["uv", "pip", "install", "--python", sys.executable]
+                else:
+                    pip_cmd = [sys.executable, "-m", "pip", "install", "--prefer-binary", "--no-compile"]
+                subprocess.run(pip_cmd + missing_packages, check=True)
                 logger.info("Packages installed successfully.")
                 return True
             except subprocess.CalledProcessError:
@@ -54,23 +131,28 @@ def check_dependencies():
             logger.warning("Continuing without installing missing packages.")
             return False
     
+    os.makedirs('instance', exist_ok=True)
+    open(marker, 'w').close()
     return True
 
-def check_kaggle_credentials():
+def check_kaggle_credentials(args):
     """Check if Kaggle credentials are available"""
+    if args.kaggle_user and args.kaggle_key:
+        os.environ['KAGGLE_USERNAME'] = args.kaggle_user
+        os.environ['KAGGLE_KEY'] = args.kaggle_key
+        logger.info("Kaggle credentials provided on the command line.")
+        return True
+    
     kaggle_username = os.environ.get('KAGGLE_USERNAME')
     kaggle_key = os.environ.get('KAGGLE_KEY')
     
     if not kaggle_username or not kaggle_key:
-        kaggle_json = os.path.expanduser("~/.kaggle/kaggle.json")
-        if os.path.exists(kaggle_json):
+        if os.access(_KAGGLE_JSON, os.F_OK):
             logger.info("Kaggle credentials found in ~/.kaggle/kaggle.json")
             return True
         
         logger.warning("Kaggle credentials not found in environment variables or kaggle.json.")
-        setup_creds = input("Do you want to set up Kaggle credentials now? (y/n): ")
-        
-        if setup_creds.lower() == 'y':
+        if _confirm("Do you want to set up Kaggle credentials now? (y/n): "):
             username = input("Enter your Kaggle username: ")
             key = input("Enter your Kaggle API key: ")
             
@@ -79,16 +161,14 @@ def check_kaggle_credentials():
             os.environ['KAGGLE_KEY'] = key
             
             # Ask if user wants to persist credentials
-            persist = input("Do you want to persist these credentials for future sessions? (y/n): ")
-            if persist.lower() == 'y':
-                kaggle_dir = os.path.expanduser("~/.kaggle")
-                os.makedirs(kaggle_dir, exist_ok=True)
+            if _confirm("Do you want to persist these credentials for future sessions? (y/n): ", args.yes):
+                os.makedirs(_KAGGLE_DIR, exist_ok=True)
                 
                 import json
-                with open(os.path.join(kaggle_dir, "kaggle.json"), "w") as f:
+                # Create the file owner-only from the start so the key is never world-readable
+                fd = os.open(_KAGGLE_JSON, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+                with os.fdopen(fd, "w") as f:
                     json.dump({"username": username, "key": key}, f)
-                
-                os.chmod(os.path.join(kaggle_dir, "kaggle.json"), 0o600)
                 logger.info("Kaggle credentials saved to ~/.kaggle/kaggle.json")
             
             return True
@@ -101,14 +181,12 @@ def check_kaggle_credentials():
 
 def setup_directories():
     """Ensure all required directories exist"""
+    # Only leaf directories are listed; their parents are created along the way
     directories = [
         'model',
-        'dataset',
-        'dataset/leprosy_dataset',
         'dataset/leprosy_dataset/positive',
         'dataset/leprosy_dataset/negative',
         'dataset/leprosy_dataset/irrelevant',
-        'test_samples',
         'test_samples/positive',
         'test_samples/negative',
         'test_results',
@@ -116,71 +194,153 @@ def setup_directories():
         'instance'
     ]
     
+    # One mkdir per directory in the common case; parents are only created when missing
     for directory in directories:
-        os.makedirs(directory, exist_ok=True)
-        logger.info(f"Directory {directory} ensured.")
+        try:
+            os.mkdir(directory)
+        except FileExistsError:
+            pass
+        except FileNotFoundError:
+            os.makedirs(directory, exist_ok=True)
+        logger.info("Directory %s ensured.", directory)
     
     return True
 
-def run_data_preparation():
-    """Run the data preparation scripts"""
-    if not os.path.exists('model/leprosy_classifier.pkl'):
-        # Check if datasets are already downloaded
-        positive_dir = 'dataset/leprosy_dataset/positive'
-        negative_dir = 'dataset/leprosy_dataset/negative'
-        
-        if (not os.path.exists(positive_dir) or len(os.listdir(positive_dir)) < 10 or
-            not os.path.exists(negative_dir) or len(os.listdir(negative_dir)) < 10):
-            
-            logger.info("Datasets not found or incomplete. Preparing to download...")
-            credentials_ready = check_kaggle_credentials()
-            
-            if credentials_ready:
-                logger.info("Running prepare_kaggle_data.py...")
-                try:
-                    subprocess.check_call([sys.executable, "prepare_kaggle_data.py"])
-                    logger.info("Dataset preparation completed successfully.")
-                except subprocess.CalledProcessError:
-                    logger.error("Failed to prepare datasets.")
-                    return False
-            else:
-                logger.error("Cannot prepare datasets without Kaggle credentials.")
-                return False
+def _has_at_least(path, n):
+    """Check if a directory contains at least n entries without listing all of them"""
+    try:
+        with os.scandir(path) as it:
+            return sum(1 for _ in itertools.islice(it, n)) >= n
+    except FileNotFoundError:
+        return False
+
+def _training_data_fingerprint():
+    """Fingerprint the training data from file names, sizes and modification times"""
+    digest = hashlib.blake2b(digest_size=8)
+    for directory in _FINGERPRINT_DIRS:
+        try:
+            it = os.scandir(directory)
+        except FileNotFoundError:
+            entries = None
         else:
-            logger.info("Datasets already downloaded.")
+            entries = []
+            with it:
+                for entry in it:
+                    # Dangling symlinks are skipped, as retrain_model.py skips them too
+                    try:
+                        stat = entry.stat()
+                    except OSError:
+                        continue
+                    entries.append((entry.name, stat.st_size, int(stat.st_mtime)))
+            entries.sort()
+        digest.update(repr((directory, entries)).encode())
+    return digest.hexdigest()
+
+def _model_stamp():
+    """Identify the current model file by its size and modification time"""
+    stat = os.stat(_MODEL_PATH)
+    return f"{stat.st_size}:{stat.st_mtime_ns}"
+
+def _model_status():
+    """Compare the trained model against the fingerprint written when setup trained it
+    
+    Returns:
+        str: 'missing' if there is no model, 'foreign' if the model was not
+        produced by setup, 'current' if it matches the training data, or
+        'stale' if the training data has changed since
+    """
+    if not os.access(_MODEL_PATH, os.F_OK):
+        return 'missing'
+    try:
+        with open(_FINGERPRINT_PATH) as f:
+            recorded_stamp, recorded_digest = f.read().split()
+    except (FileNotFoundError, ValueError):
+        return 'foreign'
+    if recorded_stamp != _model_stamp():
+        return 'foreign'
+    if recorded_digest != _training_data_fingerprint():
+        return 'stale'
+    return 'current'
+
+def _run_step(script, success_message, failure_message):
+    """Run a preparation script and report whether it succeeded"""
+    import subprocess
+    try:
+        subprocess.run([sys.executable, script], check=True)
+        logger.info(success_message)
+        return True
+    except subprocess.CalledProcessError:
+        logger.error(failure_message)
+        return False
+
+def run_data_preparation(args):
+    """Run the data preparation scripts
+    
+    The steps form a strict chain and must run in order: test samples are
+    copied from the downloaded dataset, and the model is trained on the
+    test samples.
+    """
+    status = _model_status()
+    if not args.retrain:
+        if status == 'current':
+            logger.info("Model is up to date with the test samples. Skipping data preparation and training.")
+            return True
+        if status == 'foreign':
+            logger.info("Model was not produced by setup. Keeping it; use --retrain to replace it.")
+            return True
+    if status == 'stale':
+        logger.info("Test samples changed since the model was trained. Retraining...")
+    
+    # Check if datasets are already downloaded
+    positive_dir = 'dataset/leprosy_dataset/positive'
+    negative_dir = 'dataset/leprosy_dataset/negative'
+    
+    if not _has_at_least(positive_dir, 10) or not _has_at_least(negative_dir, 10):
         
-        # Prepare test samples
-        test_pos_dir = 'test_samples/positive'
-        test_neg_dir = 'test_samples/negative'
+        logger.info("Datasets not found or incomplete. Preparing to download...")
+        credentials_ready = check_kaggle_credentials(args)
         
-        if (not os.path.exists(test_pos_dir) or len(os.listdir(test_pos_dir)) < 5 or
-            not os.path.exists(test_neg_dir) or len(os.listdir(test_neg_dir)) < 5):
-            
-            logger.info("Test samples not found or incomplete. Preparing...")
-            try:
-                subprocess.check_call([sys.executable, "prepare_test_samples.py"])
-                logger.info("Test samples prepared successfully.")
-            except subprocess.CalledProcessError:
-                logger.error("Failed to prepare test samples.")
+        if credentials_ready:
+            logger.info("Running prepare_kaggle_data.py...")
+            if not _run_step("prepare_kaggle_data.py",
+                             "Dataset preparation completed successfully.",
+                             "Failed to prepare datasets."):
                 return False
         else:
-            logger.info("Test samples already prepared.")
+            logger.error("Cannot prepare datasets without Kaggle credentials.")
+            return False
+    else:
+        logger.info("Datasets already downloaded.")
+    
+    # Prepare test samples
+    test_pos_dir = 'test_samples/positive'
+    test_neg_dir = 'test_samples/negative'
+    
+    if not _has_at_least(test_pos_dir, 5) or not _has_at_least(test_neg_dir, 5):
         
-        # Train the model
-        logger.info("Training the model...")
-        try:
-            subprocess.check_call([sys.executable, "retrain_model.py"])
-            logger.info("Model training completed successfully.")
-        except subprocess.CalledProcessError:
-            logger.error("Failed to train the model.")
+        logger.info("Test samples not found or incomplete. Preparing...")
+        if not _run_step("prepare_test_samples.py",
+                         "Test samples prepared successfully.",
+                         "Failed to prepare test samples."):
             return False
     else:
-        logger.info("Model already exists. Skipping data preparation and training.")
+        logger.info("Test samples already prepared.")
+    
+    # Train the model
+    logger.info("Training the model...")
+    if not _run_step("retrain_model.py",
+                     "Model training completed successfully.",
+                     "Failed to train the model."):
+        return False
+    
+    with open(_FINGERPRINT_PATH, 'w') as f:
+        f.write(f"{_model_stamp()} {_training_data_fingerprint()}\n")
     
     return True
 
 def main():
     """Main setup function"""
+    args = parse_args()
     logger.info("Starting setup for Leprosy Detection AI Application...")
     
     # Check prerequisites
@@ -188,7 +348,7 @@ def main():
         logger.error("Setup failed: Incompatible Python version.")
         return False
     
-    if not check_dependencies():
+    if not check_dependencies(args):
         logger.warning("Setup may not work correctly without required packages.")
     
     # Setup directories
@@ -197,7 +357,9 @@ def main():
         return False
     
     # Run data preparation
-    if not run_data_preparation():
+    if args.skip_data:
+        logger.info("Skipping data preparation and training.")
+    elif not run_data_preparation(args):
         logger.warning("Data preparation incomplete. The application may not work properly.")
     
     logger.info("Setup completed successfully!")
@@ -206,6 +368,11 @@ def main():
     return True
 
 if __name__ == "__main__":
+    # Configure logging; the format does not use caller, thread or process info
+    logging.logThreads = False
+    logging.logProcesses = False
+    logging._srcfile = None
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
     success = main()
     if not success:
         sys.exit(1)
\ No newline at end of file